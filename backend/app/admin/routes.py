@@ -0,0 +1,141 @@
+"""
+Административные маршруты: профилирование приложения на лету.
+
+Доступ только по заголовку X-Admin-Token, совпадающему с переменной
+окружения ADMIN_TOKEN. Если ADMIN_TOKEN не задан, маршруты отключены.
+"""
+
+import logging
+import os
+import secrets
+from typing import Annotated, Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from ..utils import profiler
+
+
+logger = logging.getLogger(__name__)
+
+
+# Токен администратора. Без него административные маршруты недоступны.
+ADMIN_TOKEN: Optional[str] = os.environ.get("ADMIN_TOKEN") or None
+
+
+def require_admin(
+    x_admin_token: Annotated[Optional[str], Header(description="Токен администратора")] = None,
+) -> None:
+    """
+    Проверяет токен администратора из заголовка X-Admin-Token.
+    """
+    if ADMIN_TOKEN is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin API is disabled (ADMIN_TOKEN is not set).",
+        )
+    # Сравниваем байты: compare_digest не принимает str с не-ASCII символами
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin token.",
+        )
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+class ProfileStatus(BaseModel):
+    """
+    Состояние профилировщика.
+    """
+
+    active: bool = Field(..., description="Идёт ли окно профилирования")
+    samples: int = Field(..., description="Количество снятых сэмплов стеков")
+    unique_stacks: int = Field(..., description="Количество уникальных стеков")
+    slow_requests: int = Field(..., description="Сохранено медленных запросов")
+    remaining_seconds: float = Field(..., description="Сколько осталось до конца окна")
+
+
+@router.post(
+    "/profile/start",
+    response_model=ProfileStatus,
+    summary="Запуск окна профилирования",
+)
+def start_profiling(
+    duration: Annotated[
+        float,
+        Query(gt=0, le=profiler.MAX_DURATION_SECONDS, description="Длительность окна, с"),
+    ] = 30.0,
+    interval_ms: Annotated[
+        float,
+        Query(ge=profiler.MIN_INTERVAL_SECONDS * 1000, description="Шаг сэмплирования стеков, мс"),
+    ] = 10.0,
+) -> ProfileStatus:
+    """
+    Запускает сэмплирование стеков и сбор медленных запросов на заданное окно.
+
+    Обычная (не async) функция: остановка предыдущего окна ждёт поток-сэмплер,
+    поэтому FastAPI выполняет её в пуле потоков, не блокируя event loop.
+    """
+    try:
+        profiler.start(duration=duration, interval=interval_ms / 1000.0)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(exc),
+        ) from exc
+    logger.warning("Администратор запустил профилирование на %.1f с.", duration)
+    return ProfileStatus(**profiler.status())
+
+
+@router.post(
+    "/profile/stop",
+    response_model=ProfileStatus,
+    summary="Досрочная остановка профилирования",
+)
+def stop_profiling() -> ProfileStatus:
+    """
+    Останавливает окно профилирования; собранные данные остаются доступны.
+    """
+    profiler.stop()
+    return ProfileStatus(**profiler.status())
+
+
+@router.get(
+    "/profile/status",
+    response_model=ProfileStatus,
+    summary="Состояние профилировщика",
+)
+async def profiling_status() -> ProfileStatus:
+    """
+    Возвращает состояние текущего (или последнего) окна профилирования.
+    """
+    return ProfileStatus(**profiler.status())
+
+
+@router.get(
+    "/profile/stacks",
+    response_class=PlainTextResponse,
+    summary="Агрегированные стеки для flamegraph",
+)
+async def profiling_stacks() -> str:
+    """
+    Возвращает стеки в collapsed-формате (`frame;frame;... count`),
+    пригодном для flamegraph.pl / speedscope.
+    """
+    return profiler.collapsed_stacks()
+
+
+@router.get(
+    "/profile/slow-requests",
+    summary="Самые медленные запросы окна",
+)
+async def profiling_slow_requests() -> List[Dict[str, Any]]:
+    """
+    Возвращает самые медленные запросы /flows/analyze с разбивкой по этапам.
+    """
+    return profiler.slow_requests()
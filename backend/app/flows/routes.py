@@ -3,13 +3,15 @@
 """
 
 import logging
-from typing import Annotated, Literal
+import time
+from typing import Annotated, Dict, Literal, Optional
 
 from fastapi import APIRouter, Body, HTTPException, status
 from pydantic import BaseModel, Field, IPvAnyAddress
 
 from ..ml.inference import ANOMALY_THRESHOLD, predict_risk_score
-from ..utils.blocker import block_ip
+from ..utils import escalation, profiler
+from ..utils.blocker import block_ip, is_blocked
 
 
 logger = logging.getLogger(__name__)
@@ -91,17 +93,31 @@ async def analyze_flow(
     """
     Принимает flow-данные, делает ML-инференс и, при необходимости, блокирует IP.
     """
+    # Поэтапные тайминги собираем только во время окна профилирования
+    timings: Optional[Dict[str, float]] = {} if profiler.is_active() else None
+    started = time.perf_counter()
+    src_ip: Optional[str] = None
+    risk_score: Optional[float] = None
+    error: Optional[str] = None
+
     try:
         # Преобразуем в dict с учётом alias ("Tot sum")
         feature_dict = payload.model_dump(by_alias=True)
         src_ip = str(feature_dict.pop("src_ip"))
 
         # Инференс
-        result = predict_risk_score(feature_dict)
+        result = predict_risk_score(feature_dict, timings)
         risk_score = float(result["risk_score"])
         is_anomaly = bool(result["is_anomaly"])
 
-        # Логируем и блокируем IP при превышении порога
+        # Учитываем risk_score в истории источника: блокируем не по одной
+        # аномалии, а по политике эскалации (k превышений из последних n).
+        # Уже заблокированные источники пропускаем — повторный block_ip не нужен.
+        should_block = not is_blocked(src_ip) and escalation.observe(
+            src_ip, risk_score, ANOMALY_THRESHOLD
+        )
+
+        # Логируем аномалию и блокируем IP, если сработала эскалация
         if is_anomaly:
             logger.warning(
                 "Обнаружена аномалия. IP=%s, risk_score=%.4f (> %.2f)",
@@ -109,8 +125,10 @@ async def analyze_flow(
                 risk_score,
                 ANOMALY_THRESHOLD,
             )
-            block_ip(src_ip)
-        else:
+        if should_block:
+            with profiler.stage(timings, "block"):
+                block_ip(src_ip)
+        if not is_anomaly:
             logger.info(
                 "Трафик нормальный. IP=%s, risk_score=%.4f (<= %.2f)",
                 src_ip,
@@ -125,10 +143,22 @@ async def analyze_flow(
             src_ip=src_ip,
         )
     except Exception as exc:  # noqa: BLE001
+        error = f"{type(exc).__name__}: {exc}"
         logger.exception("Ошибка при анализе flow-данных: %s", exc)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error during flow analysis.",
         ) from exc
+    finally:
+        # Медленные запросы записываем и при ошибке — часто это они и есть
+        if timings is not None:
+            profiler.record_request(
+                "/flows/analyze",
+                time.perf_counter() - started,
+                timings,
+                src_ip=src_ip,
+                risk_score=risk_score,
+                error=error,
+            )
 
 
@@ -1,10 +1,20 @@
+import asyncio
+import contextlib
 import logging
 from pathlib import Path
 
 from fastapi import FastAPI
 
+from .admin.routes import router as admin_router
 from .flows.routes import router as flows_router
 from .ml.model_loader import load_model_and_scaler
+from .utils import profiler
+from .utils.blocker import (
+    EXPIRY_CHECK_INTERVAL_SECONDS,
+    expire_blocks,
+    next_expiry_in,
+    sync_from_kernel,
+)
 
 
 # Базовая конфигурация логирования для всего приложения
@@ -33,6 +43,8 @@ def create_app() -> FastAPI:
 
     # Подключаем роутер с namespace /flows
     fastapi_app.include_router(flows_router, prefix="/flows", tags=["flows"])
+    # Административные маршруты (профилирование), защищены ADMIN_TOKEN
+    fastapi_app.include_router(admin_router, prefix="/admin", tags=["admin"])
 
     @fastapi_app.on_event("startup")
     async def on_startup() -> None:
@@ -43,9 +55,42 @@ def create_app() -> FastAPI:
         load_model_and_scaler(model_path=MODEL_PATH, scaler_path=SCALER_PATH)
         logger.info("ML модель и scaler успешно загружены.")
 
+        # Восстанавливаем состояние блокировок из iptables и запускаем их истечение
+        await asyncio.to_thread(sync_from_kernel)
+        fastapi_app.state.expiry_task = asyncio.create_task(_expire_blocks_loop())
+
+    @fastapi_app.on_event("shutdown")
+    async def on_shutdown() -> None:
+        """
+        Шатдаун-хук: останавливаем профилировщик и фоновую задачу снятия блокировок.
+        """
+        await asyncio.to_thread(profiler.stop)
+
+        task = getattr(fastapi_app.state, "expiry_task", None)
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
     return fastapi_app
 
 
+async def _expire_blocks_loop() -> None:
+    """
+    Фоновая задача: спит до ближайшего истечения блокировки (но не дольше
+    EXPIRY_CHECK_INTERVAL_SECONDS) и снимает все просроченные блокировки разом.
+    """
+    while True:
+        delay = next_expiry_in()
+        if delay is None or delay > EXPIRY_CHECK_INTERVAL_SECONDS:
+            delay = EXPIRY_CHECK_INTERVAL_SECONDS
+        await asyncio.sleep(delay)
+        try:
+            await asyncio.to_thread(expire_blocks)
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Ошибка при снятии просроченных блокировок: %s", exc)
+
+
 app = create_app()
 
 
@@ -2,13 +2,28 @@
 Модуль для блокировки IP-адресов на уровне iptables.
 
 Блокировка управляется флагом ENABLE_BLOCKING.
+
+Каждая блокировка живёт BLOCK_TTL_SECONDS секунд. Сроки истечения хранятся
+в min-куче, поэтому фоновая задача снимает все просроченные блокировки одним
+проходом и одним вызовом iptables-restore. При старте приложение один раз
+читает текущие правила из ядра (`sync_from_kernel`) и восстанавливает по ним
+своё состояние, чтобы не добавлять дубликаты.
+
+Правила приложения помечаются комментарием RULE_COMMENT: синхронизация и
+снятие блокировок касаются только их, правила, добавленные вручную, не трогаются.
+Правила без комментария, оставшиеся от предыдущих версий, можно однократно
+перевести под управление приложения (MIGRATE_UNTAGGED_RULES).
 """
 
+import heapq
 import logging
 import os
 import platform
 import subprocess
-from typing import Final
+import threading
+import time
+from collections import Counter
+from typing import Dict, Final, List, Optional, Tuple
 
 
 logger = logging.getLogger(__name__)
@@ -18,17 +33,119 @@ logger = logging.getLogger(__name__)
 # Для безопасного запуска в dev/на macOS имеет смысл держать False.
 ENABLE_BLOCKING: Final[bool] = True
 
+# Время жизни блокировки (секунды). Повторная аномалия продлевает блокировку.
+BLOCK_TTL_SECONDS: Final[float] = 3600.0
+
+# Как часто фоновая задача проверяет просроченные блокировки (секунды).
+EXPIRY_CHECK_INTERVAL_SECONDS: Final[float] = 30.0
+
+# Цепочки, в которые добавляются DROP-правила:
+# FORWARD — трафик от IoT устройств через Gateway,
+# INPUT — прямой трафик на Orange Pi.
+BLOCK_CHAINS: Final[Tuple[str, ...]] = ("FORWARD", "INPUT")
+
+# Комментарий (`-m comment`), которым помечаются DROP-правила приложения.
+RULE_COMMENT: Final[str] = "sentineliot"
+
+# Однократная миграция: при старте с SENTINELIOT_MIGRATE_RULES=1 простые правила
+# `-s <ip>/32 -j DROP` без комментария (их добавляли предыдущие версии) заменяются
+# одним помеченным правилом и далее истекают по TTL. Правила, добавленные вручную
+# той же командой, при этом тоже будут подхвачены — включайте один раз при обновлении.
+MIGRATE_UNTAGGED_RULES: Final[bool] = os.environ.get("SENTINELIOT_MIGRATE_RULES") == "1"
+
+
+# IP -> момент истечения блокировки (time.monotonic()).
+_BLOCKED: Dict[str, float] = {}
+# Min-куча (expires_at, ip), одна запись на IP. После продления блокировки
+# срок в куче отстаёт от _BLOCKED и обновляется при извлечении.
+_EXPIRY_HEAP: List[Tuple[float, str]] = []
+_LOCK = threading.Lock()
+
 
 def _is_root() -> bool:
     """Проверяет, запущен ли процесс с правами root."""
     return os.geteuid() == 0
 
 
-def block_ip(ip: str) -> None:
+def _can_block() -> bool:
+    """Проверяет, можно ли выполнять реальные вызовы iptables."""
+    if not ENABLE_BLOCKING:
+        return False
+    return platform.system() == "Linux"
+
+
+def _with_sudo(cmd: List[str]) -> List[str]:
+    """Добавляет sudo к команде, если процесс запущен не от root."""
+    return cmd if _is_root() else ["sudo"] + cmd
+
+
+def _run(cmd: List[str], ip: str = "", stdin: Optional[str] = None) -> Optional[str]:
+    """
+    Выполняет команду iptables и возвращает stdout либо None при ошибке.
+    """
+    try:
+        result = subprocess.run(
+            cmd,
+            check=True,
+            capture_output=True,
+            text=True,
+            input=stdin,
+            timeout=5,
+        )
+    except subprocess.CalledProcessError as exc:
+        error_msg = exc.stderr or exc.stdout or "Неизвестная ошибка"
+        logger.error(
+            "Ошибка при выполнении iptables для IP %s (команда: %s): %s",
+            ip,
+            " ".join(cmd),
+            error_msg,
+        )
+        return None
+    except FileNotFoundError:
+        logger.error("%s не найден в PATH. Убедитесь, что iptables установлен.", cmd[0])
+        return None
+    except subprocess.TimeoutExpired:
+        logger.error("Таймаут при выполнении %s для IP %s", " ".join(cmd), ip)
+        return None
+
+    return result.stdout
+
+
+def _rule_spec(ip: str) -> List[str]:
+    """Условие и действие DROP-правила приложения для IP (без команды и цепочки)."""
+    return ["-s", ip, "-m", "comment", "--comment", RULE_COMMENT, "-j", "DROP"]
+
+
+def _legacy_rule_spec(ip: str) -> List[str]:
+    """DROP-правило без комментария, которое добавляли предыдущие версии."""
+    return ["-s", ip, "-j", "DROP"]
+
+
+def _schedule(ip: str, ttl: float) -> None:
+    """
+    Запоминает (или продлевает) блокировку IP. Вызывается под _LOCK.
+
+    В куче держим одну запись на IP: при продлении меняется только срок
+    в _BLOCKED, а запись в куче переставляется в expire_blocks.
+    """
+    expires_at = time.monotonic() + ttl
+    if ip not in _BLOCKED:
+        heapq.heappush(_EXPIRY_HEAP, (expires_at, ip))
+    _BLOCKED[ip] = expires_at
+
+
+def is_blocked(ip: str) -> bool:
+    """Возвращает True, если IP сейчас заблокирован приложением."""
+    with _LOCK:
+        return ip in _BLOCKED
+
+
+def block_ip(ip: str, ttl: float = BLOCK_TTL_SECONDS) -> None:
     """
     Блокирует IP-адрес с помощью iptables, если ENABLE_BLOCKING == True и ОС — Linux.
 
-    В проде стратегию блокировки (chain/policy) можно расширить.
+    Если IP уже заблокирован, правила не добавляются повторно — блокировка
+    только продлевается на ttl секунд.
     """
     if not ip:
         logger.warning("block_ip вызван с пустым IP, пропускаем.")
@@ -48,6 +165,12 @@ def block_ip(ip: str) -> None:
         )
         return
 
+    with _LOCK:
+        if ip in _BLOCKED:
+            _schedule(ip, ttl)
+            logger.debug("IP %s уже заблокирован, блокировка продлена на %.0f с.", ip, ttl)
+            return
+
     # Проверка прав root
     if not _is_root():
         logger.warning(
@@ -57,52 +180,192 @@ def block_ip(ip: str) -> None:
             ip,
         )
         # Пробуем использовать sudo (может не сработать без настройки sudoers)
-        use_sudo = True
-    else:
-        use_sudo = False
-
-    # Команды iptables для блокировки трафика от указанного IP
-    # Блокируем в FORWARD chain (для трафика от IoT устройств через Gateway)
-    # и в INPUT chain (для прямого трафика на Orange Pi)
-    commands = [
-        ["iptables", "-A", "FORWARD", "-s", ip, "-j", "DROP"],
-        ["iptables", "-A", "INPUT", "-s", ip, "-j", "DROP"],
-    ]
 
     success_count = 0
-    for cmd in commands:
-        # Добавляем sudo если нужно
-        final_cmd = ["sudo"] + cmd if use_sudo else cmd
-        
+    for chain in BLOCK_CHAINS:
+        final_cmd = _with_sudo(["iptables", "-A", chain, *_rule_spec(ip)])
+
         logger.info("Выполняем блокировку IP через iptables: %s", " ".join(final_cmd))
-        try:
-            result = subprocess.run(
-                final_cmd,
-                check=True,
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            success_count += 1
-            logger.debug("Правило добавлено: %s", " ".join(final_cmd))
-        except subprocess.CalledProcessError as exc:
-            error_msg = exc.stderr or exc.stdout or "Неизвестная ошибка"
-            logger.error(
-                "Ошибка при выполнении iptables для IP %s (команда: %s): %s",
-                ip,
-                " ".join(final_cmd),
-                error_msg,
-            )
-        except FileNotFoundError:
-            logger.error("iptables не найден в PATH. Убедитесь, что iptables установлен.")
-            break
-        except subprocess.TimeoutExpired:
-            logger.error("Таймаут при выполнении iptables для IP %s", ip)
-            break
+        if _run(final_cmd, ip) is None:
+            continue
+        success_count += 1
+        logger.debug("Правило добавлено: %s", " ".join(final_cmd))
 
     if success_count > 0:
+        with _LOCK:
+            _schedule(ip, ttl)
         logger.info("IP %s успешно заблокирован через iptables (%d правил добавлено).", ip, success_count)
     else:
         logger.warning("Не удалось добавить правила блокировки для IP %s", ip)
 
 
+def _apply_batch(commands: List[List[str]], ips: str) -> bool:
+    """
+    Применяет команды вида ["-D", chain, ...] одним вызовом iptables-restore.
+
+    --noflush оставляет все прочие правила нетронутыми.
+    """
+    lines = ["*filter", *(" ".join(command) for command in commands), "COMMIT"]
+    cmd = _with_sudo(["iptables-restore", "--noflush"])
+    return _run(cmd, ips, stdin="\n".join(lines) + "\n") is not None
+
+
+def _remove_rules(rules: List[Tuple[str, str]]) -> bool:
+    """
+    Удаляет DROP-правила приложения (пары (цепочка, IP)) одним вызовом iptables-restore.
+    """
+    commands = [["-D", chain, *_rule_spec(ip)] for chain, ip in rules]
+    return _apply_batch(commands, ",".join(sorted({ip for _, ip in rules})))
+
+
+def expire_blocks(now: Optional[float] = None) -> List[str]:
+    """
+    Снимает все блокировки с истёкшим сроком и возвращает список разблокированных IP.
+    """
+    if now is None:
+        now = time.monotonic()
+
+    expired: List[str] = []
+    with _LOCK:
+        while _EXPIRY_HEAP and _EXPIRY_HEAP[0][0] <= now:
+            _, ip = heapq.heappop(_EXPIRY_HEAP)
+            expires_at = _BLOCKED.get(ip)
+            if expires_at is None:
+                continue
+            # Блокировка была продлена — возвращаем запись в кучу с новым сроком
+            if expires_at > now:
+                heapq.heappush(_EXPIRY_HEAP, (expires_at, ip))
+                continue
+            del _BLOCKED[ip]
+            expired.append(ip)
+
+    if not expired or not _can_block():
+        return expired
+
+    if _remove_rules([(chain, ip) for ip in expired for chain in BLOCK_CHAINS]):
+        logger.info("Сняты просроченные блокировки: %d IP (%s).", len(expired), ", ".join(expired))
+        return expired
+
+    # iptables-restore атомарен: если хоть одного правила нет (например, его
+    # удалили вручную), пакет целиком откатывается. Удаляем правила по одному.
+    logger.warning(
+        "Не удалось снять просроченные блокировки одним пакетом, удаляем по одному (%d IP).",
+        len(expired),
+    )
+    for ip in expired:
+        for chain in BLOCK_CHAINS:
+            _run(_with_sudo(["iptables", "-D", chain, *_rule_spec(ip)]), ip)
+    return expired
+
+
+def next_expiry_in(now: Optional[float] = None) -> Optional[float]:
+    """
+    Сколько секунд осталось до ближайшей проверки (None, если блокировок нет).
+
+    Вершина кучи может хранить срок до продления, поэтому значение — нижняя оценка.
+    """
+    if now is None:
+        now = time.monotonic()
+    with _LOCK:
+        if not _EXPIRY_HEAP:
+            return None
+        return max(0.0, _EXPIRY_HEAP[0][0] - now)
+
+
+def _parse_drop_rules(output: str, chain: str, tagged: bool = True) -> List[str]:
+    """
+    Извлекает IP из правил приложения вида
+    `-A <chain> -s <ip>/32 -m comment --comment <RULE_COMMENT> -j DROP` (вывод `iptables -S`),
+    а при tagged=False — из простых правил `-A <chain> -s <ip>/32 -j DROP`.
+
+    Правила с другими условиями пропускаются.
+    IP возвращается столько раз, сколько раз встречается правило.
+    """
+    # Всё после `-s <ip>`
+    suffix = _rule_spec("")[2:] if tagged else _legacy_rule_spec("")[2:]
+    ips: List[str] = []
+    for line in output.splitlines():
+        parts = line.split()
+        if parts[:3] != ["-A", chain, "-s"] or parts[4:] != suffix:
+            continue
+        addr = parts[3]
+        if addr.endswith("/32"):
+            addr = addr[: -len("/32")]
+        elif "/" in addr:
+            # Подсеть — не наша блокировка одного IP
+            continue
+        ips.append(addr)
+    return ips
+
+
+def _migrate_legacy_rules(legacy: Counter, counts: Counter) -> None:
+    """
+    Заменяет все копии правил без комментария одним помеченным правилом
+    (если его ещё нет). При успехе добавляет IP в counts.
+    """
+    commands: List[List[str]] = []
+    for (chain, ip), count in legacy.items():
+        commands.extend(["-D", chain, *_legacy_rule_spec(ip)] for _ in range(count))
+        if (chain, ip) not in counts:
+            commands.append(["-A", chain, *_rule_spec(ip)])
+
+    ips = {ip for _, ip in legacy}
+    if not _apply_batch(commands, ",".join(sorted(ips))):
+        logger.warning(
+            "Не удалось перевести %d правил без комментария под управление приложения.",
+            sum(legacy.values()),
+        )
+        return
+
+    counts.update(rule for rule in legacy if rule not in counts)
+    logger.info(
+        "Миграция: %d правил без комментария заменены помеченными (%d IP).",
+        sum(legacy.values()),
+        len(ips),
+    )
+
+
+def sync_from_kernel(ttl: float = BLOCK_TTL_SECONDS) -> int:
+    """
+    Читает существующие DROP-правила из iptables и восстанавливает по ним
+    состояние блокировок. Вызывается один раз при старте приложения.
+
+    Исходное время блокировки ядру неизвестно, поэтому найденные IP получают
+    полный ttl. Дубликаты правил удаляются, чтобы в каждой цепочке осталось
+    ровно одно правило на IP. При MIGRATE_UNTAGGED_RULES правила без комментария
+    заменяются помеченными. Возвращает количество восстановленных блокировок.
+    """
+    if not _can_block():
+        logger.info("Синхронизация с iptables пропущена: реальная блокировка недоступна.")
+        return 0
+
+    counts: Counter = Counter()
+    legacy: Counter = Counter()
+    for chain in BLOCK_CHAINS:
+        output = _run(_with_sudo(["iptables", "-S", chain]))
+        if output is None:
+            continue
+        counts.update((chain, ip) for ip in _parse_drop_rules(output, chain))
+        if MIGRATE_UNTAGGED_RULES:
+            legacy.update((chain, ip) for ip in _parse_drop_rules(output, chain, tagged=False))
+
+    duplicates = [rule for rule, count in counts.items() for _ in range(count - 1)]
+    if duplicates:
+        if _remove_rules(duplicates):
+            logger.info("Удалено %d дублирующихся правил блокировки.", len(duplicates))
+        else:
+            logger.warning("Не удалось удалить %d дублирующихся правил блокировки.", len(duplicates))
+
+    if legacy:
+        _migrate_legacy_rules(legacy, counts)
+
+    found = {ip for _, ip in counts}
+
+    with _LOCK:
+        _BLOCKED.clear()
+        _EXPIRY_HEAP.clear()
+        for ip in found:
+            _schedule(ip, ttl)
+
+    logger.info("Восстановлено %d блокировок из iptables.", len(found))
+    return len(found)
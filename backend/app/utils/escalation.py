@@ -0,0 +1,121 @@
+"""
+Модуль для принятия решения о блокировке IP по истории его flow-записей.
+
+Для каждого src_ip хранится кольцевой буфер флагов превышения порога
+для последних ESCALATION_WINDOW flow-записей. IP блокируется, если не менее
+ESCALATION_HITS из них превысили порог (политика "k из n"), либо сразу — если risk_score превысил
+IMMEDIATE_BLOCK_THRESHOLD.
+
+Таблица ограничена MAX_SOURCES записями: источники хранятся в порядке
+последнего обращения (LRU), простаивающие дольше SOURCE_IDLE_SECONDS и
+самые старые сверх лимита вытесняются.
+"""
+
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Final, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+# Политика "k из n": блокировать после ESCALATION_HITS превышений
+# среди последних ESCALATION_WINDOW flow-записей источника
+ESCALATION_WINDOW: Final[int] = 5
+ESCALATION_HITS: Final[int] = 3
+
+# Порог, при превышении которого IP блокируется сразу, без накопления истории
+IMMEDIATE_BLOCK_THRESHOLD: Final[float] = 0.95
+
+# Ограничения памяти таблицы источников
+MAX_SOURCES: Final[int] = 65536
+SOURCE_IDLE_SECONDS: Final[float] = 600.0
+
+
+class _SourceState:
+    """
+    Компактное состояние одного источника: кольцевой буфер флагов (0/1)
+    превышения порога и их сумма.
+    """
+
+    __slots__ = ("hit_flags", "pos", "filled", "hits", "last_seen")
+
+    def __init__(self, now: float) -> None:
+        self.hit_flags = array("b", bytes(ESCALATION_WINDOW))
+        self.pos = 0
+        self.filled = 0
+        self.hits = 0
+        self.last_seen = now
+
+    def push(self, risk_score: float, threshold: float) -> None:
+        """Учитывает risk_score, вытесняя самый старый флаг окна."""
+        if self.filled == ESCALATION_WINDOW:
+            self.hits -= self.hit_flags[self.pos]
+        else:
+            self.filled += 1
+
+        hit = 1 if risk_score > threshold else 0
+        self.hit_flags[self.pos] = hit
+        self.hits += hit
+        self.pos = (self.pos + 1) % ESCALATION_WINDOW
+
+    def reset(self) -> None:
+        """Очищает окно (после блокировки счёт начинается заново)."""
+        self.pos = 0
+        self.filled = 0
+        self.hits = 0
+
+
+# src_ip -> состояние; порядок — от давно не активных к недавним
+_SOURCES: "OrderedDict[str, _SourceState]" = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _evict(now: float) -> None:
+    """Вытесняет простаивающие и лишние источники. Вызывается под _LOCK."""
+    idle_before = now - SOURCE_IDLE_SECONDS
+    while _SOURCES:
+        oldest = next(iter(_SOURCES.values()))
+        if oldest.last_seen >= idle_before and len(_SOURCES) <= MAX_SOURCES:
+            break
+        _SOURCES.popitem(last=False)
+
+
+def observe(src_ip: str, risk_score: float, threshold: float, now: Optional[float] = None) -> bool:
+    """
+    Учитывает очередной risk_score источника и возвращает True,
+    если по политике эскалации IP нужно заблокировать.
+    """
+    if now is None:
+        now = time.monotonic()
+
+    with _LOCK:
+        state = _SOURCES.get(src_ip)
+        if state is None:
+            state = _SourceState(now)
+            _SOURCES[src_ip] = state
+        else:
+            _SOURCES.move_to_end(src_ip)
+            state.last_seen = now
+
+        state.push(risk_score, threshold)
+        should_block = risk_score > IMMEDIATE_BLOCK_THRESHOLD or state.hits >= ESCALATION_HITS
+        hits = state.hits
+        if should_block:
+            state.reset()
+
+        _evict(now)
+
+    if should_block:
+        logger.debug(
+            "Эскалация для IP=%s: risk_score=%.4f, превышений %d из %d.",
+            src_ip,
+            risk_score,
+            hits,
+            ESCALATION_WINDOW,
+        )
+    return should_block
+
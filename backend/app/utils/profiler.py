@@ -0,0 +1,208 @@
+"""
+Модуль для профилирования приложения "на лету" без внешних профилировщиков.
+
+Профилирование включается администратором на ограниченное окно времени:
+- фоновый поток раз в interval секунд снимает стеки всех потоков
+  (sys._current_frames) и агрегирует их в collapsed-формат для flamegraph;
+- /flows/analyze записывает поэтапные тайминги, а модуль хранит
+  N самых медленных запросов текущего окна.
+
+Пока профилирование выключено, поток не запущен, а обработчик запроса
+только проверяет флаг `is_active()`; `stage()` при этом ничего не измеряет.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Final, Iterator, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+# Сколько самых медленных запросов хранить
+SLOW_REQUESTS_LIMIT: Final[int] = 20
+
+# Ограничения окна профилирования и частоты сэмплирования (секунды)
+MAX_DURATION_SECONDS: Final[float] = 300.0
+MIN_INTERVAL_SECONDS: Final[float] = 0.001
+
+# Максимальная глубина стека, которую сохраняем
+MAX_STACK_DEPTH: Final[int] = 128
+
+
+_LOCK = threading.Lock()
+_ACTIVE: bool = False
+_STOP_EVENT: Optional[threading.Event] = None
+_THREAD: Optional[threading.Thread] = None
+_STACKS: Counter = Counter()
+_SAMPLES: int = 0
+# Min-куча (duration, seq, record): на вершине самый быстрый из сохранённых
+_SLOW: List[Tuple[float, int, Dict[str, Any]]] = []
+_SEQ = itertools.count()
+_STARTED_AT: Optional[float] = None
+_ENDS_AT: Optional[float] = None
+
+
+def is_active() -> bool:
+    """Возвращает True, если сейчас идёт окно профилирования."""
+    return _ACTIVE
+
+
+def _frame_label(frame: Any) -> str:
+    """Имя кадра для collapsed-стека: `<файл>:<функция>`."""
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(frame: Any) -> str:
+    """Сворачивает стек кадра в строку `root;...;leaf`."""
+    labels: List[str] = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+def _sample_loop(stop_event: threading.Event, interval: float, ends_at: float) -> None:
+    """Тело потока-сэмплера: снимает стеки до истечения окна или остановки."""
+    global _SAMPLES, _ACTIVE
+
+    own_ident = threading.get_ident()
+    while not stop_event.wait(interval):
+        if time.monotonic() >= ends_at:
+            break
+        frames = sys._current_frames()
+        stacks = [_collapse(frame) for ident, frame in frames.items() if ident != own_ident]
+        del frames
+        with _LOCK:
+            _STACKS.update(stacks)
+            _SAMPLES += 1
+
+    with _LOCK:
+        if _STOP_EVENT is stop_event:
+            _ACTIVE = False
+    logger.info("Окно профилирования завершено. Снято сэмплов: %d", _SAMPLES)
+
+
+def start(duration: float, interval: float) -> None:
+    """
+    Запускает окно профилирования на duration секунд с шагом сэмплирования interval.
+
+    Результаты предыдущего окна сбрасываются.
+    """
+    global _ACTIVE, _STOP_EVENT, _THREAD, _SAMPLES, _STARTED_AT, _ENDS_AT
+
+    if duration <= 0 or duration > MAX_DURATION_SECONDS:
+        raise ValueError(f"duration должен быть в диапазоне (0, {MAX_DURATION_SECONDS}]")
+    if interval < MIN_INTERVAL_SECONDS or interval >= duration:
+        raise ValueError(f"interval должен быть в диапазоне [{MIN_INTERVAL_SECONDS}, duration)")
+
+    stop()
+
+    stop_event = threading.Event()
+    now = time.monotonic()
+    with _LOCK:
+        _STACKS.clear()
+        _SLOW.clear()
+        _SAMPLES = 0
+        _STARTED_AT = now
+        _ENDS_AT = now + duration
+        _STOP_EVENT = stop_event
+        _ACTIVE = True
+        _THREAD = threading.Thread(
+            target=_sample_loop,
+            args=(stop_event, interval, _ENDS_AT),
+            name="stack-sampler",
+            daemon=True,
+        )
+        _THREAD.start()
+
+    logger.info("Профилирование запущено на %.1f с (шаг %.3f с).", duration, interval)
+
+
+def stop() -> None:
+    """Досрочно останавливает окно профилирования (результаты сохраняются)."""
+    global _ACTIVE
+
+    with _LOCK:
+        stop_event, thread = _STOP_EVENT, _THREAD
+        _ACTIVE = False
+
+    if stop_event is not None:
+        stop_event.set()
+    if thread is not None and thread is not threading.current_thread():
+        thread.join(timeout=1.0)
+
+
+@contextmanager
+def stage(timings: Optional[Dict[str, float]], name: str) -> Iterator[None]:
+    """
+    Записывает длительность блока (секунды) в timings[name].
+
+    Если timings is None (профилирование выключено), ничего не измеряет.
+    """
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+def record_request(name: str, total: float, stages: Dict[str, float], **extra: Any) -> None:
+    """
+    Запоминает запрос, если он входит в SLOW_REQUESTS_LIMIT самых медленных
+    за текущее окно. Вызывать только при is_active().
+    """
+    record: Dict[str, Any] = {
+        "name": name,
+        "total_ms": total * 1000.0,
+        "stages_ms": {stage: value * 1000.0 for stage, value in stages.items()},
+        "timestamp": time.time(),
+        **extra,
+    }
+    item = (total, next(_SEQ), record)
+    with _LOCK:
+        if len(_SLOW) < SLOW_REQUESTS_LIMIT:
+            heapq.heappush(_SLOW, item)
+        elif total > _SLOW[0][0]:
+            heapq.heapreplace(_SLOW, item)
+
+
+def collapsed_stacks() -> str:
+    """Возвращает агрегированные стеки в collapsed-формате (`stack count` на строку)."""
+    with _LOCK:
+        items = _STACKS.most_common()
+    return "".join(f"{stack} {count}\n" for stack, count in items)
+
+
+def slow_requests() -> List[Dict[str, Any]]:
+    """Возвращает самые медленные запросы окна, от самого медленного."""
+    with _LOCK:
+        items = sorted(_SLOW, reverse=True)
+    return [record for _, _, record in items]
+
+
+def status() -> Dict[str, Any]:
+    """Краткое состояние профилировщика."""
+    now = time.monotonic()
+    with _LOCK:
+        remaining = max(0.0, _ENDS_AT - now) if _ACTIVE and _ENDS_AT is not None else 0.0
+        return {
+            "active": _ACTIVE,
+            "samples": _SAMPLES,
+            "unique_stacks": len(_STACKS),
+            "slow_requests": len(_SLOW),
+            "remaining_seconds": remaining,
+        }